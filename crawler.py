@@ -1,16 +1,32 @@
 import argparse
+import csv
+import hashlib
 import json
 import logging
 import os
+import re
+import shelve
+import threading
 import time
 import traceback
-import pandas as pd
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.csv as pacsv
 
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from functools import wraps
+from operator import methodcaller
 from omegaconf import OmegaConf
 from typing import List
 from tqdm import tqdm
 from tweepy import Client, User, Tweet, Paginator
 
+try:
+    import orjson
+except ImportError: # Optional, fall back to `json`.
+    orjson = None
+
 
 # Logging format.
 _LOG_FMT = '%(asctime)s - %(levelname)s - %(name)s -   %(message)s'
@@ -44,9 +60,269 @@ def log_trace(e):
     LOG.error(''.join(traceback.TracebackException.from_exception(e).format()))
 
 
+def get_hashtags(tweet: Tweet):
+    """ Get hashtags from the tweet `entities`.
+    
+    Args:
+        tweet: Tweet object.
+    
+    Returns:
+        List of hashtags, or `None` if the tweet has no hashtags.
+    """
+    if tweet.entities and "hashtags" in tweet.entities:
+        return [tag["tag"] for tag in tweet.entities["hashtags"]]
+
+
+def has_no_followings(user: User):
+    """ Check whether the followings of the user cannot be crawled or are empty.
+    
+    Args:
+        user: User object.
+    
+    Returns:
+        Whether the user is protected or follows no one.
+    """
+    metrics = user.get("public_metrics") or {}
+    return bool(user.get("protected")) or metrics.get("following_count") == 0
+
+
+def to_text(values):
+    """ Convert nested values (e.g., list of hashtags) to text, which can be written to `.csv`.
+    
+    Args:
+        values: List of column values.
+    
+    Returns:
+        List of column values.
+    """
+    return [str(value) if isinstance(value, (list, dict)) else value for value in values]
+
+
+def fingerprint(*values):
+    """ Get a short hash of the values (e.g., query and time window).
+    
+    Args:
+        values: JSON-serializable values.
+    
+    Returns:
+        Hex digest.
+    """
+    return hashlib.sha1(json.dumps(values).encode()).hexdigest()[:12]
+
+
+def read_csv_header(path):
+    """ Read the column names from the header of the `.csv` file.
+    
+    Args:
+        path: Path to the `.csv` file.
+    
+    Returns:
+        List of column names, or empty list if the file is empty.
+    """
+    with open(path, newline="", encoding="utf-8") as f:
+        return next(csv.reader(f), [])
+
+
+def read_csv_column(path, column):
+    """ Read a column from the `.csv` file.
+    
+    Args:
+        path: Path to the `.csv` file.
+        column: Column name.
+    
+    Returns:
+        List of column values.
+    """
+    table = pacsv.read_csv(path,
+        parse_options=pacsv.ParseOptions(newlines_in_values=True), # Tweets may contain line breaks.
+        convert_options=pacsv.ConvertOptions(include_columns=[column])
+    )
+    return table[column].to_pylist()
+
+
+class ColumnStore:
+    """ Column-oriented buffer of `int64` IDs for social network interactions. """
+    
+    def __init__(self, columns: List[str], capacity=1024):
+        """ Constructor for `ColumnStore`.
+        
+        Args:
+            columns: Column names.
+            capacity: Initial number of rows allocated for each column (Default=`1024`).
+        """
+        capacity = max(1, capacity) # Capacity is doubled when full, so it can't start at 0.
+        self.columns = {column:np.empty(capacity, dtype=np.int64) for column in columns}
+        self.capacity = capacity
+        self.size = 0
+    
+    
+    def __len__(self):
+        return self.size
+    
+    
+    def append(self, *values):
+        """ Append a row, doubling the capacity of every column when full.
+        
+        Args:
+            values: Value of each column, in column order.
+        """
+        if self.size == self.capacity:
+            self.capacity *= 2
+            for name, column in self.columns.items():
+                grown = np.empty(self.capacity, dtype=np.int64)
+                grown[:self.size] = column
+                self.columns[name] = grown
+        
+        for column, value in zip(self.columns.values(), values):
+            column[self.size] = int(value)
+        self.size += 1
+    
+    
+    def to_dict(self):
+        """ Get the stored rows without copying.
+        
+        Returns:
+            Dictionary of column name and array view.
+        """
+        return {name:column[:self.size] for name, column in self.columns.items()}
+    
+    
+    def clear(self):
+        """ Remove all rows while keeping the allocated capacity. """
+        self.size = 0
+
+
+class RateLimitedClient(Client):
+    """ Twitter API v2 client that waits for the rate limit of an endpoint to reset before exceeding it.
+    
+    The remaining requests and reset time of each endpoint are read from the
+    `x-rate-limit-remaining` and `x-rate-limit-reset` response headers.
+    """
+    
+    def __init__(self, *args, **kwargs):
+        """ Constructor for `RateLimitedClient`.
+        
+        Args:
+            args: Arguments to pass to `Client`.
+            kwargs: Keyword arguments to pass to `Client`.
+        """
+        super().__init__(*args, **kwargs)
+        self.rate_limits = {} # Endpoint: (remaining requests, reset epoch time).
+        self._in_flight = {} # Endpoint: number of requests sent but not yet answered.
+        self._rate_limits_lock = threading.Lock()
+    
+    
+    def request(self, method, route, params=None, json=None, user_auth=False):
+        """ Send a request once the rate limit of its endpoint allows it.
+        
+        Args:
+            method: HTTP method.
+            route: API route (e.g., `/2/users/44196397/following`).
+            params: Query parameters.
+            json: JSON body.
+            user_auth: Whether to use OAuth 1.0a User Context.
+        
+        Returns:
+            HTTP response.
+        """
+        endpoint = re.sub(r"(?<!^)/\d+(?=/|$)", "/:id", route) # Rate limits apply per endpoint, not per ID.
+        self.wait_rate_limit(endpoint)
+        response = None
+        try:
+            response = super().request(method, route, params=params, json=json, user_auth=user_auth)
+        finally:
+            with self._rate_limits_lock:
+                self._in_flight[endpoint] -= 1
+                if response is not None:
+                    self.update_rate_limit(endpoint, response)
+        return response
+    
+    
+    def update_rate_limit(self, endpoint, response):
+        """ Update the rate limit of the endpoint from the response headers.
+        
+        Responses of concurrent requests can arrive out of order, so the headers are
+        merged rather than overwriting the stored rate limit: requests still in flight
+        are not counted by the headers yet, the smaller remaining is kept within the
+        same window, and responses from an earlier window are ignored.
+        The caller must hold `_rate_limits_lock`.
+        
+        Args:
+            endpoint: API endpoint (e.g., `/2/users/:id/following`).
+            response: HTTP response.
+        """
+        if "x-rate-limit-remaining" not in response.headers or "x-rate-limit-reset" not in response.headers:
+            return
+        
+        remaining = int(response.headers["x-rate-limit-remaining"]) - self._in_flight[endpoint]
+        reset = int(response.headers["x-rate-limit-reset"])
+        if endpoint in self.rate_limits:
+            stored_remaining, stored_reset = self.rate_limits[endpoint]
+            if reset < stored_reset:
+                return
+            if reset == stored_reset:
+                remaining = min(remaining, stored_remaining)
+        self.rate_limits[endpoint] = (remaining, reset)
+    
+    
+    def wait_rate_limit(self, endpoint):
+        """ Wait until the endpoint has a request left, and reserve it as in flight.
+        
+        Args:
+            endpoint: API endpoint (e.g., `/2/users/:id/following`).
+        """
+        while True:
+            with self._rate_limits_lock:
+                remaining, reset = self.rate_limits.get(endpoint, (1, 0))
+                wait = reset - time.time()
+                if remaining > 0 or wait <= 0:
+                    if endpoint in self.rate_limits:
+                        self.rate_limits[endpoint] = (remaining - 1, reset)
+                    self._in_flight[endpoint] = self._in_flight.get(endpoint, 0) + 1
+                    return
+            
+            LOG.info(f"Rate limit of '{endpoint}' reached. Sleeping for {wait:.0f} seconds.")
+            time.sleep(wait + 1)
+
+
 class Crawler:
     """ Twitter social network crawler (Twitter API v2). """
     
+    # Arrow types of the tweet and user columns, so they are not inferred from the values on every flush.
+    # Columns not listed here (e.g., other fields added to the config) are still inferred.
+    _COLUMN_TYPES = {
+        "tweet": {
+            "id": pa.int64(),
+            "author_id": pa.int64(),
+            "conversation_id": pa.int64(),
+            "in_reply_to_user_id": pa.int64(),
+            "text": pa.string(),
+            "lang": pa.string(),
+            "source": pa.string(),
+            "reply_settings": pa.string(),
+            "possibly_sensitive": pa.bool_(),
+            "created_at": pa.timestamp("us", tz="UTC"),
+            "context_annotations": pa.string(),
+            "tag": pa.string(),
+        },
+        "user": {
+            "id": pa.int64(),
+            "pinned_tweet_id": pa.int64(),
+            "name": pa.string(),
+            "username": pa.string(),
+            "description": pa.string(),
+            "location": pa.string(),
+            "url": pa.string(),
+            "profile_image_url": pa.string(),
+            "verified": pa.bool_(),
+            "protected": pa.bool_(),
+            "created_at": pa.timestamp("us", tz="UTC"),
+            "followers_count": pa.int64(),
+            "following_count": pa.int64(),
+            "tweet_count": pa.int64(),
+        },
+    }
+    
     def __init__(self, config):
         """ Constructor for `Crawler`.
         
@@ -55,24 +331,85 @@ class Crawler:
         """
         self.config = config
         
+        # Cache the config values used for every request and row, as `OmegaConf` lookups are slow.
+        self._tweet_fields = list(self.config.TWEET_FIELDS)
+        self._user_fields = list(self.config.USER_FIELDS)
+        self._expansions = list(self.config.EXPANSIONS)
+        self._base_query = self.config.QUERY
+        self._rt_base_query = self.config.RETWEET_QUERY
+        self._sleep_time = self.config.SLEEP_TIME
+        self._flush_size = self.config.FLUSH_SIZE
+        
         # Authenticate to the Twitter API v2.
         self.client = self.authenticate()
         
-        # Create dictionary for storing tweet data.
-        self.tweet_dict = {field:[] for field in self.config.TWEET_FIELDS if field != "entities"}
-        if "entities" in self.config.TWEET_FIELDS:
-            self.tweet_dict.update({"tag":[]})
+        # Create getter of each tweet column and dictionary for storing tweet data.
+        self._tweet_getters = [(field, methodcaller("get", field)) for field in self._tweet_fields if field != "entities"]
+        if "entities" in self._tweet_fields:
+            self._tweet_getters.append(("tag", get_hashtags)) # Get hashtags from `entities`.
+        self.tweet_dict = {column:[] for column, _ in self._tweet_getters}
         
-        # Create dictionary for storing user data.
-        self.user_dict = {field:[] for field in self.config.USER_FIELDS if field != "public_metrics"}
-        if "public_metrics" in self.config.USER_FIELDS:
-            self.user_dict.update({"followers_count":[], "following_count":[], "tweet_count":[]})
-
-        # Create dictionary for storing social network interactions.
-        self.follow_dict = {"user_id":[], "following_id":[]}
-        self.post_dict = {"user_id":[], "tweet_id":[]}
-        self.retweet_dict = {"user_id":[], "tweet_id":[]}
-        self.like_dict = {"user_id":[], "tweet_id":[]}
+        # Create getter of each user column and dictionary for storing user data.
+        self._user_getters = [(field, methodcaller("get", field)) for field in self._user_fields if field != "public_metrics"]
+        if "public_metrics" in self._user_fields:
+            # Get followers, followings, and tweet count from `public_metrics`.
+            self._user_getters += [(metric, lambda user, metric=metric: user.public_metrics[metric])
+                                   for metric in ["followers_count", "following_count", "tweet_count"]]
+        self.user_dict = {column:[] for column, _ in self._user_getters}
+        
+        # Create sets of collected tweet and user IDs for fast deduplication.
+        self._tweet_ids = set()
+        self._user_ids = set()
+        
+        # Create set of user IDs whose followings are not requested (see `has_no_followings`).
+        self._skip_followings = set()
+        
+        # Create column stores for storing social network interactions. They are flushed when
+        # they reach `FLUSH_SIZE` rows, so allocating that many rows up front avoids any reallocation.
+        self.follow_store = ColumnStore(["user_id", "following_id"], capacity=self._flush_size)
+        self.post_store = ColumnStore(["user_id", "tweet_id"], capacity=self._flush_size)
+        self.retweet_store = ColumnStore(["user_id", "tweet_id"], capacity=self._flush_size)
+        self.like_store = ColumnStore(["user_id", "tweet_id"], capacity=self._flush_size)
+        
+        # Map each dictionary and store to its output table. Rows are appended to the `.csv`
+        # files every `FLUSH_SIZE` rows, so they only buffer the latest rows.
+        self._tables = {
+            "tweet": self.tweet_dict,
+            "user": self.user_dict,
+            "follow": self.follow_store,
+            "post": self.post_store,
+            "retweet": self.retweet_store,
+            "like": self.like_store,
+        }
+        self._written = {name:0 for name in self._tables}
+        
+        # Scope the cached `post`/`retweet` crawls by their query and time window, so changing
+        # them crawls the users again. `follow`/`like` requests do not depend on them.
+        self._seen_scopes = {
+            "post": fingerprint(self._base_query, self.config.START_TIME, self.config.END_TIME),
+            "retweet": fingerprint(self._rt_base_query, self.config.START_TIME, self.config.END_TIME),
+        }
+        
+        # Create the output directory. When skipping recently crawled users, keep the output
+        # of previous runs and open the cache of crawled users, otherwise remove the output.
+        os.makedirs(self.config.SAVE_PATH, exist_ok=True)
+        self._seen = None
+        self._seen_lock = threading.Lock()
+        self._pending_seen = {} # Crawled users not written to the cache until their data is flushed.
+        if self.config.SEEN_DAYS > 0:
+            self.load()
+            self._seen = shelve.open(os.path.join(self.config.SAVE_PATH, ".seen_cache"))
+        else:
+            for path in [self.table_path(name) for name in self._tables] + [self.progress_path()]:
+                if os.path.exists(path):
+                    os.remove(path)
+        
+        # Lock of each table for updating it from concurrent workers.
+        self._locks = {name:threading.Lock() for name in self._tables}
+        
+        # Request slot shared by all workers to avoid rate limit.
+        self._rate_lock = threading.Lock()
+        self._next_request = 0.0
     
     
     def authenticate(self):
@@ -81,7 +418,8 @@ class Crawler:
         Returns:
             Twitter API v2 Client.
         """
-        client = Client(bearer_token=self.config.BEARER_TOKEN, wait_on_rate_limit=True)
+        # Still wait on `429 Too Many Requests`, e.g., when other apps share the rate limit.
+        client = RateLimitedClient(bearer_token=self.config.BEARER_TOKEN, wait_on_rate_limit=True)
         LOG.info(f"Authentication success ({'Academic' if self.config.ACADEMIC_ACCESS else 'General'} access).")
         return client
     
@@ -92,39 +430,288 @@ class Crawler:
         Returns:
             Initial query for the crawler.
         """      
-        f = open(self.config.INIT_PATH)
-        init_query = json.load(f)
-        f.close()
+        with open(self.config.INIT_PATH, "rb") as f:
+            init_query = orjson.loads(f.read()) if orjson else json.load(f)
         return init_query
     
     
+    def throttle(self):
+        """ Wait for the next request slot shared by all workers.
+        
+        Keeps the whole crawler at one request per `SLEEP_TIME` seconds,
+        however many workers are running (Tweepy docs: https://bit.ly/3L5qxbA).
+        Slots are counted from the start of each request, so the time spent
+        waiting for a response is not slept again.
+        """
+        with self._rate_lock:
+            wait = self._next_request - time.monotonic()
+            if wait > 0:
+                time.sleep(wait)
+            self._next_request = time.monotonic() + self._sleep_time
+    
+    
+    def table_path(self, name):
+        """ Get the output path of the table.
+        
+        Args:
+            name: Table name (e.g., `tweet`, `user`, `follow`).
+        
+        Returns:
+            Path to the `.csv` file.
+        """
+        return os.path.join(self.config.SAVE_PATH, f"{name}.csv")
+    
+    
+    def load(self):
+        """ Load the number of rows and the collected tweet and user IDs from previous runs.
+        
+        Raises:
+            ValueError: If the columns of an output file do not match the configured fields,
+                as the rows of this run cannot be appended to it.
+        """
+        for name, table in self._tables.items():
+            path = self.table_path(name)
+            if os.path.exists(path) and os.path.getsize(path) > 0:
+                columns = list(table.columns if isinstance(table, ColumnStore) else table)
+                header = read_csv_header(path)
+                if header != columns:
+                    raise ValueError(f"Columns of '{path}' {header} do not match the configured columns {columns}. "
+                                     f"Move the output of previous runs, or set `SEEN_DAYS: 0` to overwrite it.")
+                
+                column = "id" if "id" in columns else columns[0]
+                values = read_csv_column(path, column)
+                self._written[name] = len(values)
+                
+                if name == "tweet" and column == "id":
+                    self._tweet_ids.update(values)
+                elif name == "user" and column == "id":
+                    self._user_ids.update(values)
+        
+        interactions = sum(self._written[name] for name in ["follow", "post", "retweet", "like"])
+        LOG.info(f"Loaded {len(self._tweet_ids)} tweets, {len(self._user_ids)} users, and "
+                 f"{interactions} interactions from '{self.config.SAVE_PATH}'")
+    
+    
+    def load_followings(self, user_ids):
+        """ Load the followings of the users from the `follow` table of previous runs.
+        
+        The table is read in batches, so only the matching followings are kept in memory.
+        
+        Args:
+            user_ids: List of user IDs.
+        
+        Returns:
+            Set of following user IDs.
+        """
+        path = self.table_path("follow")
+        followings = set()
+        if not user_ids or not os.path.exists(path) or os.path.getsize(path) == 0:
+            return followings
+        
+        user_ids = pa.array(user_ids, type=pa.int64())
+        reader = pacsv.open_csv(path,
+            convert_options=pacsv.ConvertOptions(column_types={"user_id": pa.int64(), "following_id": pa.int64()})
+        )
+        for batch in reader:
+            mask = pc.is_in(batch.column("user_id"), value_set=user_ids)
+            followings.update(pc.filter(batch.column("following_id"), mask).to_pylist())
+        return followings
+    
+    
+    def progress_path(self):
+        """ Get the path of the crawl progress, which is used to resume an interrupted crawl.
+        
+        Returns:
+            Path to the `.json` file.
+        """
+        return os.path.join(self.config.SAVE_PATH, "progress.json")
+    
+    
+    def read_progress(self):
+        """ Read the progress of an interrupted crawl.
+        
+        Returns:
+            Crawl progress, or `None` if there is nothing to resume.
+        """
+        if self._seen is None or not os.path.exists(self.progress_path()):
+            return None
+        with open(self.progress_path()) as f:
+            progress = json.load(f)
+        
+        # Seed users found with another query or time window are not resumed.
+        if progress.get("seen_scopes") != self._seen_scopes:
+            LOG.info(f"Query or time window changed since '{self.progress_path()}' was written. Crawl from the start.")
+            return None
+        return progress
+    
+    
+    def write_progress(self, progress):
+        """ Write the progress of the crawl, replacing the previous one atomically.
+        
+        Users crawled after this point are resumed from the cache of crawled users.
+        
+        Args:
+            progress: Crawl progress (e.g., seed users, and users of the `post/retweet/like` phase).
+        """
+        if self._seen is None:
+            return
+        path = self.progress_path()
+        with open(f"{path}.tmp", "w") as f:
+            json.dump({**progress, "seen_scopes": self._seen_scopes}, f)
+        os.replace(f"{path}.tmp", path)
+    
+    
+    def is_seen(self, kind, user_id):
+        """ Check whether the interactions of the user were crawled within the last `SEEN_DAYS` days.
+        
+        Args:
+            kind: Kind of interaction (e.g., `follow`, `post`, `retweet`, `like`).
+            user_id: User ID.
+        
+        Returns:
+            Whether the user can be skipped.
+        """
+        if self._seen is None:
+            return False
+        key = self.seen_key(kind, user_id)
+        with self._seen_lock:
+            if key in self._pending_seen:
+                return True
+            return time.time() - self._seen.get(key, 0) < self.config.SEEN_DAYS * 86400
+    
+    
+    def mark_seen(self, kind, user_id):
+        """ Record that the interactions of the user have been crawled.
+        
+        The record is written to the cache by the next `checkpoint`, after the data of
+        the user is flushed, so a killed crawl does not skip users whose data is lost.
+        
+        Args:
+            kind: Kind of interaction (e.g., `follow`, `post`, `retweet`, `like`).
+            user_id: User ID.
+        """
+        if self._seen is not None:
+            with self._seen_lock:
+                self._pending_seen[self.seen_key(kind, user_id)] = time.time()
+    
+    
+    def seen_key(self, kind, user_id):
+        """ Get the key of the user in the cache of crawled users.
+        
+        Args:
+            kind: Kind of interaction (e.g., `follow`, `post`, `retweet`, `like`).
+            user_id: User ID.
+        
+        Returns:
+            Cache key (e.g., `follow:44196397`, or `post:<scope>:44196397` for scoped kinds).
+        """
+        scope = self._seen_scopes.get(kind)
+        return f"{kind}:{scope}:{user_id}" if scope else f"{kind}:{user_id}"
+    
+    
+    def count(self, name):
+        """ Count the rows of the table, both written and buffered.
+        
+        Args:
+            name: Table name (e.g., `tweet`, `user`, `follow`).
+        
+        Returns:
+            Number of rows.
+        """
+        return self._written[name] + self.buffered(name)
+    
+    
+    def buffered(self, name):
+        """ Count the rows of the table that are not written yet.
+        
+        Args:
+            name: Table name (e.g., `tweet`, `user`, `follow`).
+        
+        Returns:
+            Number of buffered rows.
+        """
+        table = self._tables[name]
+        return len(table) if isinstance(table, ColumnStore) else len(next(iter(table.values())))
+    
+    
+    def flush(self, name, force=False):
+        """ Append the buffered rows of the table to its `.csv` file and clear the buffer.
+        
+        The caller must hold the lock of the table.
+        
+        Args:
+            name: Table name (e.g., `tweet`, `user`, `follow`).
+            force: Whether to flush before the buffer reaches `FLUSH_SIZE` (Default=`False`).
+        """
+        size = self.buffered(name)
+        if not force and size < self._flush_size:
+            return
+        
+        table = self._tables[name]
+        if isinstance(table, ColumnStore):
+            data = {column:pa.array(values, type=pa.int64()) for column, values in table.to_dict().items()}
+        else:
+            types = self._COLUMN_TYPES[name]
+            data = {column:pa.array(to_text(values), type=types.get(column)) for column, values in table.items()}
+        
+        with open(self.table_path(name), "ab") as f:
+            write_options = pacsv.WriteOptions(include_header=f.tell() == 0) # Write header to new file only.
+            pacsv.write_csv(pa.Table.from_pydict(data), f, write_options=write_options)
+        self._written[name] += size
+        
+        if isinstance(table, ColumnStore):
+            table.clear()
+        else:
+            for column in table.values():
+                column.clear()
+    
+    
+    def paginate(self, method, **kwargs):
+        """ Set paginator that waits for a request slot before requesting each page.
+        
+        Args:
+            method: Client method to paginate for.
+            kwargs: Keyword arguments to pass to `Paginator`.
+        
+        Returns:
+            Paginator.
+        """
+        @wraps(method) # Keep the method name, which `Paginator` uses to choose the pagination token.
+        def paced_method(*args, **method_kwargs):
+            self.throttle()
+            return method(*args, **method_kwargs)
+        
+        return Paginator(paced_method, **kwargs)
+    
+    
     def update_tweet(self, tweet: Tweet):
         """ Update tweet data to the dictionary.
         
         Args:
             tweet: Tweet object.
         """
-        if tweet.id not in self.tweet_dict["id"]:
-            for field in self.tweet_dict:
-                # Get hashtags from `entities`.
-                if field == "tag" and tweet.entities and "hashtags" in tweet.entities:
-                    value = [tag["tag"] for tag in tweet.entities["hashtags"]]
-                
-                # Get data from each field.
-                else:
-                    value = tweet.get(field)
-    
-                self.tweet_dict[field].append(value)
+        self.update_tweets([tweet])
     
     
     def update_tweets(self, tweets: List[Tweet]):
-        """ Update the list of tweets to the dictionary.
+        """ Update the list of tweets (e.g., a page of results) to the dictionary.
+        
+        New tweets are added column by column rather than tweet by tweet.
         
         Args:
             tweets: List of tweet objects.
         """
-        for tweet in tweets:
-            self.update_tweet(tweet)
+        with self._locks["tweet"]:
+            new_tweets = []
+            for tweet in tweets:
+                if tweet.id not in self._tweet_ids:
+                    self._tweet_ids.add(tweet.id)
+                    new_tweets.append(tweet)
+            
+            for column, getter in self._tweet_getters:
+                self.tweet_dict[column].extend(map(getter, new_tweets))
+            
+            self.flush("tweet")
     
     
     def update_user(self, user: User):
@@ -133,71 +720,88 @@ class Crawler:
         Args:
             user: User object.
         """
-        if user.id not in self.user_dict["id"]:
-            for field in self.user_dict:
-                # Get followers, followings, and tweet count from `public_metrics`.
-                if field in ["followers_count", "following_count", "tweet_count"]:
-                    value = user.public_metrics[field]
-                
-                # Get data from each field.
-                else:
-                    value = user.get(field)
-                    
-                self.user_dict[field].append(value)
-
-
+        self.update_users([user])
+    
+    
     def update_users(self, users: List[User]):
         """ Update the list of user to the dictionary.
         
+        Users are often included in many pages, so collected users are skipped before
+        taking the lock, and new users are added column by column. Users whose followings
+        are not requested are checked for every user, including users of previous runs.
+        
         Args:
             users: List of user objects.
         """
-        for user in users:
-            self.update_user(user)
+        self._skip_followings.update([user.id for user in users if has_no_followings(user)])
+        users = [user for user in users if user.id not in self._user_ids]
+        if not users:
+            return
+        
+        with self._locks["user"]:
+            new_users = []
+            for user in users:
+                if user.id not in self._user_ids:
+                    self._user_ids.add(user.id)
+                    new_users.append(user)
+            
+            for column, getter in self._user_getters:
+                self.user_dict[column].extend(map(getter, new_users))
+            
+            self.flush("user")
+    
+    
+    def update_interaction(self, name, user_id, target_id):
+        """ Update the interaction to its column store.
+        
+        Args:
+            name: Interaction name (`follow`, `post`, `retweet`, or `like`).
+            user_id: User ID.
+            target_id: Following user ID or tweet ID.
+        """
+        with self._locks[name]:
+            self._tables[name].append(user_id, target_id)
+            self.flush(name)
     
     
     def update_following(self, user_id, following_id):
-        """ Update the `follow` interaction to the dictionary.
+        """ Update the `follow` interaction to the column store.
         
         Args:
             user_id: User ID.
             following_id: Following user ID.
         """
-        self.follow_dict["user_id"].append(user_id)
-        self.follow_dict["following_id"].append(following_id)
+        self.update_interaction("follow", user_id, following_id)
     
     
     def update_post(self, user_id, tweet_id):
-        """ Update the `post` interaction to the dictionary.
+        """ Update the `post` interaction to the column store.
         
         Args:
             user_id: User ID.
             tweet_id: Tweet ID.
         """
-        self.post_dict["user_id"].append(user_id)
-        self.post_dict["tweet_id"].append(tweet_id)
+        self.update_interaction("post", user_id, tweet_id)
     
     
     def update_retweet(self, user_id, tweet_id):
-        """ Update the `retweet` interaction to the dictionary.
+        """ Update the `retweet` interaction to the column store.
         
         Args:
             user_id: User ID.
             tweet_id: Tweet ID.
         """
-        self.retweet_dict["user_id"].append(user_id)
-        self.retweet_dict["tweet_id"].append(tweet_id)
+        self.update_interaction("retweet", user_id, tweet_id)
     
     
     def update_like(self, user_id, tweet_id):
-        """ Update the `like` interaction to the dictionary.
+        """ Update the `like` interaction to the column store.
         
         Args:
             user_id: User ID.
             tweet_id: Tweet ID.
         """
-        self.like_dict["user_id"].append(user_id)
-        self.like_dict["tweet_id"].append(tweet_id)
+        self.update_interaction("like", user_id, tweet_id)
     
     
     def get_user_followings(self, user_id):
@@ -205,57 +809,93 @@ class Crawler:
         
         Args:
             user_id: User ID.
+        
+        Returns:
+            Set of following user IDs, or `None` if the followings were crawled by a previous run.
         """
+        if self.is_seen("follow", user_id):
+            return None
+        
+        # Skip the request if the user is protected or follows no one.
+        if user_id in self._skip_followings:
+            LOG.debug(f"Skip followings of user {user_id} (protected or following no one).")
+            return set()
+        
         # Set paginator.
-        pages = Paginator(self.client.get_users_following,
+        pages = self.paginate(self.client.get_users_following,
             id=user_id,
-            user_fields=list(self.config.USER_FIELDS),
+            user_fields=self._user_fields,
             max_results=self.config.FOLLOWING_MAX_RESULTS,
             limit=self.config.FOLLOWING_LIMIT
         )
         
         # Crawl data from each page.
+        followings = set()
         for following_users in pages:
-            time.sleep(self.config.SLEEP_TIME) # Sleep to avoid rate limit (Tweepy docs: https://bit.ly/3L5qxbA).
             if not following_users.errors and following_users.meta["result_count"] > 0:
-                for following_user in following_users.data:
-                    if not following_user.protected: # Filter out protected user account.
-                        self.update_following(user_id=user_id, following_id=following_user.id)
-                        self.update_user(following_user)
+                following_users = [user for user in following_users.data if not user.protected] # Filter out protected user account.
+                for following_user in following_users:
+                    self.update_following(user_id=user_id, following_id=following_user.id)
+                    followings.add(following_user.id)
+                self.update_users(following_users)
+        
+        self.mark_seen("follow", user_id)
+        return followings
+    
+    
+    @staticmethod
+    def _build_user_clause(user):
+        """ Build the query clause for tweets from the users.
+        
+        Args:
+            user: User ID or username, or list of them.
+        
+        Returns:
+            Query clause (e.g., `(from:user1 OR from:user2)`), or empty string if no user is given.
+        """
+        users = user if isinstance(user, list) else [user] if user else []
+        if not users:
+            return ""
+        return "(" + " OR ".join(str(user) if str(user).startswith("from:") else f"from:{user}" for user in users) + ")"
     
     
-    def get_user_posts(self, user=None, context=None, keyword=None, is_init=False, search_all=False):
+    def get_user_posts(self, user=None, context=None, keyword=None, is_init=False, search_all=False, max_results=None):
         """ Get the user posts.
         
         Args:
-            user: User ID or username.
+            user: User ID or username, or list of them.
             context: Specific domain id/entity id pair.
                 (e.g., 131.840160819388141570 for Tech news).
                 [See all available contexts.](https://github.com/twitterdev/twitter-context-annotations)
             keyword: Keyword or hashtag.
             is_init: Whether it is an initial crawl (Default=`False`).
+            max_results: Max results for each page (Default=`INIT_MAX_RESULTS` or `POST_MAX_RESULTS`).
 
         [Learn how to build queries](https://developer.twitter.com/en/docs/twitter-api/tweets/search/integrate/build-a-query)
+        
+        Returns:
+            Set of IDs of the users included in the results.
         """
         # Build query.
-        query = self.config.QUERY
-        query += "" if not user else f" ({user})" if user.startswith("from:") else f" (from:{user})"
+        query = self._base_query
+        query += "" if not user else f" {self._build_user_clause(user)}"
         query += "" if not context else f" ({context})" if context.startswith("context:") else f" (context:{context})"
         query += "" if not keyword else f" ({keyword})"
         
         # Set result limit.
-        max_results = self.config.INIT_MAX_RESULTS if is_init else self.config.POST_MAX_RESULTS
+        if max_results is None:
+            max_results = self.config.INIT_MAX_RESULTS if is_init else self.config.POST_MAX_RESULTS
         limit = self.config.INIT_LIMIT if is_init else self.config.POST_LIMIT
         
         # Set search method.
         method = self.client.search_all_tweets if search_all else self.client.search_recent_tweets
         
         # Set paginator.
-        pages = Paginator(method,
+        pages = self.paginate(method,
             query=query,
-            tweet_fields=list(self.config.TWEET_FIELDS),
-            user_fields=list(self.config.USER_FIELDS),
-            expansions=self.config.EXPANSIONS,
+            tweet_fields=self._tweet_fields,
+            user_fields=self._user_fields,
+            expansions=self._expansions,
             start_time=self.config.START_TIME,
             end_time=self.config.END_TIME,
             max_results=max_results,
@@ -263,51 +903,54 @@ class Crawler:
         )
 
         # Crawl data from each page.
+        found_users = set()
         for posts in pages:
-            time.sleep(self.config.SLEEP_TIME) # Sleep to avoid rate limit (Tweepy docs: https://bit.ly/3L5qxbA).
             if not posts.errors and posts.meta["result_count"] > 0:
                 for post in posts.data:
                     self.update_post(user_id=post.author_id, tweet_id=post.id)
-                    self.update_tweet(post)
+                self.update_tweets(posts.data)
         
                 # if not user:
                 self.update_users(users=posts.includes["users"])
+                found_users.update(user.id for user in posts.includes["users"])
+        
+        return found_users
     
     
-    def get_user_retweets(self, user, search_all=False):
+    def get_user_retweets(self, user, search_all=False, max_results=None):
         """ Get the user retweets.
         
         Args:
-            user: User ID or username.
+            user: User ID or username, or list of them.
+            max_results: Max results for each page (Default=`RETWEET_MAX_RESULTS`).
         
         [Learn how to build queries](https://developer.twitter.com/en/docs/twitter-api/tweets/search/integrate/build-a-query)
         """
         # Build query.
-        query = self.config.RETWEET_QUERY
-        query += "" if not user else f" ({user})" if user.startswith("from:") else f" (from:{user})"
+        query = self._rt_base_query
+        query += "" if not user else f" {self._build_user_clause(user)}"
         
         # Set search method.
         method = self.client.search_all_tweets if search_all else self.client.search_recent_tweets
         
         # Set paginator.
-        pages = Paginator(method,
+        pages = self.paginate(method,
             query=query,
-            tweet_fields=list(self.config.TWEET_FIELDS),
-            user_fields=list(self.config.USER_FIELDS),
-            expansions=self.config.EXPANSIONS,
+            tweet_fields=self._tweet_fields,
+            user_fields=self._user_fields,
+            expansions=self._expansions,
             start_time=self.config.START_TIME,
             end_time=self.config.END_TIME,
-            max_results=self.config.RETWEET_MAX_RESULTS,
+            max_results=self.config.RETWEET_MAX_RESULTS if max_results is None else max_results,
             limit=self.config.RETWEET_LIMIT
         )
         
         # Crawl data from each page.
         for retweets in pages:
-            time.sleep(self.config.SLEEP_TIME) # Sleep to avoid rate limit (Tweepy docs: https://bit.ly/3L5qxbA).
             if not retweets.errors and retweets.meta["result_count"] > 0:
                 for retweet in retweets.data:
-                    self.update_retweet(user_id=user, tweet_id=retweet.id)
-                    self.update_tweet(retweet)
+                    self.update_retweet(user_id=retweet.author_id, tweet_id=retweet.id)
+                self.update_tweets(retweets.data)
     
     
     def get_user_liked_tweets(self, user_id):
@@ -316,85 +959,244 @@ class Crawler:
         Args:
             user_id: User ID.
         """
+        if self.is_seen("like", user_id):
+            return
+        
         # Set paginator.
-        pages = Paginator(self.client.get_liked_tweets,
+        pages = self.paginate(self.client.get_liked_tweets,
             id=user_id,
-            tweet_fields=list(self.config.TWEET_FIELDS),
-            user_fields=list(self.config.USER_FIELDS),
-            expansions=self.config.EXPANSIONS,
+            tweet_fields=self._tweet_fields,
+            user_fields=self._user_fields,
+            expansions=self._expansions,
             max_results=self.config.LIKE_MAX_RESULTS,
             limit=self.config.LIKE_LIMIT
         )
         
         # Crawl data from each page.
         for likes in pages:
-            time.sleep(self.config.SLEEP_TIME) # Sleep to avoid rate limit (Tweepy docs: https://bit.ly/3L5qxbA).
             if not likes.errors and likes.meta["result_count"] > 0:
                 for like in likes.data:
                     self.update_like(user_id=user_id, tweet_id=like.id)
-                    self.update_tweet(like)
+                self.update_tweets(likes.data)
+        
+        self.mark_seen("like", user_id)
+    
+    
+    def get_user_posts_batch(self, users, search_all=False):
+        """ Get the posts of a group of users with one query (`from:user1 OR from:user2 ...`).
+        
+        Args:
+            users: List of user IDs.
+        """
+        users = [user for user in users if not self.is_seen("post", user)]
+        if users:
+            max_results = self.batch_max_results(self.config.POST_MAX_RESULTS, len(users), search_all)
+            self.get_user_posts(user=users, search_all=search_all, max_results=max_results)
+            for user in users:
+                self.mark_seen("post", user)
+    
+    
+    def get_user_retweets_batch(self, users, search_all=False):
+        """ Get the retweets of a group of users with one query (`from:user1 OR from:user2 ...`).
+        
+        Args:
+            users: List of user IDs.
+        """
+        users = [user for user in users if not self.is_seen("retweet", user)]
+        if users:
+            max_results = self.batch_max_results(self.config.RETWEET_MAX_RESULTS, len(users), search_all)
+            self.get_user_retweets(user=users, search_all=search_all, max_results=max_results)
+            for user in users:
+                self.mark_seen("retweet", user)
+    
+    
+    @staticmethod
+    def batch_max_results(max_results, num_users, search_all=False):
+        """ Get the max results for each page of a batched query.
+        
+        The max results are multiplied by the number of users, so the query takes as many pages
+        as for a single user. `group_users` keeps them within the maximum of the search endpoint
+        (100, or 500 for full-archive search), which still caps them for a single user.
+        
+        Args:
+            max_results: Max results for each page for a single user.
+            num_users: Number of users in the query.
+            search_all: Whether to use full-archive search (Default=`False`).
+        
+        Returns:
+            Max results for each page.
+        """
+        return min(max_results * num_users, 500 if search_all else 100)
+    
+    
+    def group_users(self, users, max_results):
+        """ Group users for batched search queries.
+        
+        Each group has at most `QUERY_BATCH_SIZE` users and keeps the query within the
+        length limit of the search endpoint (512 characters, or 1024 with Academic access).
+        Groups are also small enough for `max_results` per user to fit in one page (100 results,
+        or 500 with Academic access), so batching does not reduce the results of each user.
+        
+        Args:
+            users: List of user IDs.
+            max_results: Max results for each page for a single user.
+        
+        Returns:
+            List of user groups.
+        """
+        max_length = 1024 if self.config.ACADEMIC_ACCESS else 512
+        max_size = max(1, min(self.config.QUERY_BATCH_SIZE, (500 if self.config.ACADEMIC_ACCESS else 100) // max_results))
+        base_length = max(len(self._base_query), len(self._rt_base_query)) + len(" ()")
+        
+        groups, group, length = [], [], base_length
+        for user in users:
+            clause_length = len(f"from:{user}") + (len(" OR ") if group else 0)
+            if group and (len(group) >= max_size or length + clause_length > max_length):
+                groups.append(group)
+                group, length = [], base_length
+                clause_length = len(f"from:{user}")
+            group.append(user)
+            length += clause_length
+        
+        if group:
+            groups.append(group)
+        return groups
     
     
     def init_seed_tweets(self):
-        """ Initial crawl for seed tweets. """
+        """ Initial crawl for seed tweets.
+        
+        Returns:
+            List of seed user IDs, i.e., the users found by the initial queries of this run.
+        """
         LOG.info(f"Initialize seed tweets from '{self.config.INIT_PATH}' ...")
         init_query = self.read_init()
+        seed_users = set()
         for query in init_query:
-            self.get_user_posts(**query, is_init=True, search_all=self.config.ACADEMIC_ACCESS)
+            seed_users |= self.get_user_posts(**query, is_init=True, search_all=self.config.ACADEMIC_ACCESS)
+        return list(seed_users)
+    
+    
+    def wait_all(self, futures):
+        """ Wait for the crawling tasks of the workers, writing a checkpoint every `CHECKPOINT_EVERY` tasks.
+        
+        If a task fails or the crawl is interrupted, the queued tasks are cancelled, so
+        only the running tasks are waited for before the error is raised.
+        
+        Args:
+            futures: List of futures of the crawling tasks.
+        """
+        try:
+            for i, future in enumerate(tqdm(as_completed(futures), total=len(futures)), start=1):
+                future.result()
+                if i % self.config.CHECKPOINT_EVERY == 0:
+                    self.checkpoint()
+        except BaseException:
+            for future in futures:
+                future.cancel()
+            raise
     
     
     def crawl(self):
         """ Crawl social networks in Twitter. """
         try:
-            # Initialize seed tweets and seed users.
-            self.init_seed_tweets()
-            seed_users = list(self.user_dict["id"])
+            # Initialize seed tweets and seed users, or resume them from an interrupted crawl.
+            progress = self.read_progress()
+            if progress:
+                LOG.info(f"Resume crawling from '{self.progress_path()}' ...")
+            else:
+                # Users loaded from previous runs are not seeds, otherwise the graph grows on every run.
+                num_posts = self.count("post") # Each seed tweet is a `post` interaction.
+                seed_users = self.init_seed_tweets()
+                progress = {"seed_users": seed_users, "seed_tweets": self.count("post") - num_posts}
+                self.checkpoint()
+                self.write_progress(progress)
             
-            LOG.info(f"Number of seed tweets: {len(self.tweet_dict['id'])}")
+            seed_users = progress["seed_users"]
+            LOG.info(f"Number of seed tweets: {progress['seed_tweets']}")
             LOG.info(f"Number of seed users: {len(seed_users)}")
 
-            # Get `follow` interactions.
-            LOG.info("Get follow interactions ...")
-            for user_id in tqdm(seed_users):
-                self.get_user_followings(user_id=user_id)
-
-            # Get `post/retweet/like` interactions.
-            LOG.info("Get post/retweet/like interactions ...")
-            users = list(self.user_dict["id"])
-            for user_id in tqdm(users):
-                self.get_user_posts(user=str(user_id), search_all=self.config.ACADEMIC_ACCESS)
-                self.get_user_retweets(user=str(user_id), search_all=self.config.ACADEMIC_ACCESS)
-                self.get_user_liked_tweets(user_id=user_id)
+            with ThreadPoolExecutor(max_workers=self.config.MAX_WORKERS) as executor:
+                # Get `follow` interactions, unless they were already crawled before the crawl was interrupted.
+                if "users" not in progress:
+                    LOG.info("Get follow interactions ...")
+                    futures = [executor.submit(self.get_user_followings, user_id) for user_id in seed_users]
+                    self.wait_all(futures)
+                    
+                    # Crawl the seed users and their followings only, rather than every user of previous runs.
+                    # The followings of seed users crawled by a previous run are loaded from its `follow` table.
+                    users, crawled_before = set(seed_users), []
+                    for user_id, future in zip(seed_users, futures):
+                        followings = future.result()
+                        if followings is None:
+                            crawled_before.append(user_id)
+                        else:
+                            users.update(followings)
+                    users.update(self.load_followings(crawled_before))
+                    progress["users"] = list(users)
+                    self.checkpoint()
+                    self.write_progress(progress)
+
+                # Get `post/retweet/like` interactions.
+                LOG.info("Get post/retweet/like interactions ...")
+                users = progress["users"]
+                post_groups = self.group_users(users, self.config.POST_MAX_RESULTS)
+                retweet_groups = self.group_users(users, self.config.RETWEET_MAX_RESULTS)
+                futures = [executor.submit(self.get_user_posts_batch, group, self.config.ACADEMIC_ACCESS) for group in post_groups]
+                futures += [executor.submit(self.get_user_retweets_batch, group, self.config.ACADEMIC_ACCESS) for group in retweet_groups]
+                futures += [executor.submit(self.get_user_liked_tweets, user_id) for user_id in users]
+                self.wait_all(futures)
+            
+            # Crawling is finished, so there is nothing to resume.
+            if os.path.exists(self.progress_path()):
+                os.remove(self.progress_path())
             
             # Log summary.
             LOG.info("-"*50)
             LOG.info("Summary")
             LOG.info("-"*50)
-            LOG.info(f"Total of 'follow' interactions: {len(self.follow_dict['user_id'])}")
-            LOG.info(f"Total of 'post' interactions: {len(self.post_dict['user_id'])}")
-            LOG.info(f"Total of 'retweet' interactions: {len(self.retweet_dict['user_id'])}")
-            LOG.info(f"Total of 'like' interactions: {len(self.like_dict['user_id'])}")
-            LOG.info(f"Total of 'users': {len(self.user_dict['id'])}")
-            LOG.info(f"Total of 'tweets': {len(self.tweet_dict['id'])}")
+            LOG.info(f"Total of 'follow' interactions: {self.count('follow')}")
+            LOG.info(f"Total of 'post' interactions: {self.count('post')}")
+            LOG.info(f"Total of 'retweet' interactions: {self.count('retweet')}")
+            LOG.info(f"Total of 'like' interactions: {self.count('like')}")
+            LOG.info(f"Total of 'users': {self.count('user')}")
+            LOG.info(f"Total of 'tweets': {self.count('tweet')}")
             LOG.info("-"*50)
 
         except Exception as e:
             log_trace(e)
     
     
-    def save(self):
-        """ Save data to file. """
-        if not os.path.exists(self.config.SAVE_PATH):
-            os.makedirs(self.config.SAVE_PATH)
+    def checkpoint(self):
+        """ Write the buffered data and the cache of crawled users to file. """
+        # Take the crawled users before flushing, so their data is flushed before they are cached.
+        with self._seen_lock:
+            pending_seen = dict(self._pending_seen)
         
-        pd.DataFrame(self.tweet_dict).to_csv(os.path.join(self.config.SAVE_PATH, "tweet.csv"), index=False)
-        pd.DataFrame(self.user_dict).to_csv(os.path.join(self.config.SAVE_PATH, "user.csv"), index=False)
-        pd.DataFrame(self.follow_dict).to_csv(os.path.join(self.config.SAVE_PATH, "follow.csv"), index=False)
-        pd.DataFrame(self.post_dict).to_csv(os.path.join(self.config.SAVE_PATH, "post.csv"), index=False)
-        pd.DataFrame(self.retweet_dict).to_csv(os.path.join(self.config.SAVE_PATH, "retweet.csv"), index=False)
-        pd.DataFrame(self.like_dict).to_csv(os.path.join(self.config.SAVE_PATH, "like.csv"), index=False)
+        for name in self._tables:
+            with self._locks[name]:
+                self.flush(name, force=True)
         
+        if self._seen is not None:
+            with self._seen_lock:
+                self._seen.update(pending_seen)
+                self._seen.sync()
+                for key in pending_seen:
+                    self._pending_seen.pop(key, None)
+    
+    
+    def save(self):
+        """ Save the remaining buffered data to file. """
+        self.checkpoint()
         LOG.info(f"Data saved at '{self.config.SAVE_PATH}'")
+    
+    
+    def close(self):
+        """ Close the cache of crawled users. """
+        if self._seen is not None:
+            with self._seen_lock:
+                self._seen.close()
+                self._seen = None
 
 
 if __name__=='__main__':
@@ -402,6 +1204,9 @@ if __name__=='__main__':
     config = OmegaConf.load(args.cfg)
 
     crawler = Crawler(config)
-    crawler.crawl()
-    crawler.save()
+    try:
+        crawler.crawl()
+    finally: # Save the collected data even on `KeyboardInterrupt`.
+        crawler.save()
+        crawler.close()
     LOG.info("Crawling finished!")
\ No newline at end of file